@@ -1,75 +1,396 @@
 
 
+import functools
+import itertools
+import multiprocessing
 import os
-from typing import Iterable, List, Tuple
+from typing import TYPE_CHECKING, Any, Iterable, List, Optional, Tuple, Union
 
-from paddleocr import PaddleOCR
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+
+from convert_excel import POLYS_SUFFIX
+from pdf_to_preprocessed_image import preprocess_image_for_ocr, render_page
+from pipeline import Batched, run_pipeline
+
+if TYPE_CHECKING:
+    from paddleocr import PaddleOCR
 
 # Default to the latest processed output; feel free to change this path.
 DEFAULT_IMAGE_PATH = os.path.join("Processed", "giam_cuong_preprocessed.png")
+DEFAULT_PDF_PATH = os.path.join("data", "giam_cuong.pdf")
+
+OCR_IMAGE_DIR = os.path.join("output", "OCR_result")
+OCR_JSON_DIR = os.path.join("output", "OCR_json")
+
+SUPPORTED_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# Number of images handed to a single `predict` call.
+BATCH_SIZE = 16
+# Untimed predicts run before a folder so cuDNN settles on its kernels first.
+WARMUP_RUNS = 2
+
+DEVICE = "gpu"  # đổi lại cpu nếu chưa tải phiên bản của gpu
+# High-performance inference needs the PaddleOCR HPI plugin
+# (`paddleocr install_hpi_deps gpu|cpu`); set to False if it is not installed.
+ENABLE_HPI = DEVICE.startswith("gpu")
 
-# Initialize PaddleOCR once to avoid re-loading weights on every call.
-OCR_ENGINE = PaddleOCR(
-    text_detection_model_name="PP-OCRv5_mobile_det",
-    text_recognition_model_name="PP-OCRv5_mobile_rec",
-    use_doc_orientation_classify=False,
-    use_doc_unwarping=False,
-    use_textline_orientation=False,
-    device="gpu", # đổi lại cpu nếu chưa tải phiên bản của gpu
-)
+# Folder mode spreads batches over this many processes, each with its own
+# PaddleOCR engine; worker i runs on GPU i % NUM_GPUS. Every worker loads a
+# full engine (and its TensorRT workspace), so raise this only with several
+# GPUs or spare GPU memory; 1 keeps the threaded load/OCR/save pipeline.
+NUM_WORKERS = 1
+NUM_GPUS = 1
+# Workers are recycled after this many batches to shed Paddle/CUDA context bloat.
+MAX_TASKS_PER_WORKER = 50
 
+# Inference acceleration: TensorRT + FP16 on GPU, MKL-DNN on CPU.
+if DEVICE.startswith("gpu"):
+    ACCEL_OPTIONS = {
+        "precision": "fp16",
+        "use_tensorrt": True,
+    }
+else:
+    ACCEL_OPTIONS = {
+        "enable_mkldnn": True,
+        "cpu_threads": os.cpu_count() or 1,
+    }
 
-def run_ocr(image_path: str) -> List[Tuple[str, float]]:
+
+@functools.lru_cache(maxsize=1)
+def get_engine(device: str = DEVICE) -> "PaddleOCR":
     """
-    Execute PaddleOCR on the given image.
+    Build the PaddleOCR engine on first use and reuse it afterwards.
+
+    Deferring the import keeps model weights (and the cuDNN workspace) out of
+    memory until OCR is actually requested.
 
     Args:
-        image_path: Path to the image file to be processed.
+        device: Paddle device string, e.g. "gpu", "gpu:1" or "cpu".
+    """
+    from paddleocr import PaddleOCR
 
-    Returns:
-        A list of (text, confidence) tuples extracted from the image.
+    return PaddleOCR(
+        text_detection_model_name="PP-OCRv5_mobile_det",
+        text_recognition_model_name="PP-OCRv5_mobile_rec",
+        use_doc_orientation_classify=False,
+        use_doc_unwarping=False,
+        use_textline_orientation=False,
+        # Match the recognizer batch to our predict batches; set to 1 when
+        # memory-constrained to cut peak RSS.
+        text_recognition_batch_size=BATCH_SIZE,
+        device=device,
+        enable_hpi=ENABLE_HPI,
+        **ACCEL_OPTIONS,
+    )
+
+
+def _to_bgr(image: np.ndarray) -> np.ndarray:
+    """Expand a single-channel page to the 3-channel BGR layout PaddleOCR expects."""
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+
+def _predict(engine: "PaddleOCR", images: Any) -> List[Any]:
+    """
+    Call `engine.predict`, refusing 2-D arrays up front: PaddleOCR's
+    detector unpacks (h, w, c) and normalizes with a 3-channel mean.
     """
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Không tìm thấy ảnh đầu vào: {image_path}")
+    batch = images if isinstance(images, list) else [images]
+    for image in batch:
+        if isinstance(image, np.ndarray) and image.ndim != 3:
+            raise ValueError(
+                f"Ảnh đưa vào OCR phải có dạng (H, W, 3), nhận được {image.shape}."
+            )
+    return engine.predict(images)
+
 
-    result = OCR_ENGINE.predict(image_path)
+def run_ocr(
+    image: Union[str, np.ndarray, List[Union[str, np.ndarray]]],
+    name: Optional[str] = None,
+) -> List[Any]:
+    """
+    Execute PaddleOCR on the given image(s).
+
+    Args:
+        image: Path to an image file, an already decoded image array, or a
+            list of either OCR'd as one batch. A missing file makes
+            `predict` raise.
+        name: Output file stem; required when `image` contains an array,
+            since arrays carry no path to name the outputs after. Batches
+            get one file per image, suffixed `_1`, `_2`, ...
+
+    Returns:
+        The PaddleOCR results, one per input image.
+    """
+    images = image if isinstance(image, list) else [image]
+    if name is None and any(isinstance(item, np.ndarray) for item in images):
+        raise ValueError("Cần truyền 'name' khi OCR ảnh dạng mảng numpy.")
 
-    for res in result:  
-        res.print()  
-        res.save_to_img("output/OCR_result")  # lưu ra ảnh
-        res.save_to_json("output/OCR_json") # lưu ra json file
-        
+    result = _predict(get_engine(), image)
+    save_results(result, name=name)
     return result
 
 
-def run_folder(folder_path: str) -> None:
+def save_results(result: Iterable[Any], name: Optional[str] = None) -> None:
+    """
+    Print and persist PaddleOCR results.
+
+    Besides the image and JSON, the polygons are saved as an int16 [N, 4, 2]
+    array (`<json stem>_polys.npy`) that convert_excel.py --npz-polys reads
+    without re-parsing nested JSON lists.
+
+    Args:
+        result: Results returned by `PaddleOCR.predict`.
+        name: Output file stem; required when the input was an in-memory array,
+            otherwise PaddleOCR names the files after the input path. With
+            several results each gets an index suffix (`<name>_1`, ...).
+    """
+    os.makedirs(OCR_JSON_DIR, exist_ok=True)
+    results = list(result)
+    for idx, res in enumerate(results, start=1):
+        res.print()
+        if name is None:
+            if not res.get("input_path"):
+                raise ValueError("Kết quả OCR không có input_path; cần truyền 'name'.")
+            res.save_to_img(OCR_IMAGE_DIR)  # lưu ra ảnh
+            res.save_to_json(OCR_JSON_DIR)  # lưu ra json file
+            # Same stem PaddleOCR uses for the JSON it just wrote.
+            json_stem = f"{os.path.splitext(os.path.basename(res['input_path']))[0]}_res"
+        else:
+            json_stem = name if len(results) == 1 else f"{name}_{idx}"
+            res.save_to_img(os.path.join(OCR_IMAGE_DIR, f"{json_stem}.png"))
+            res.save_to_json(os.path.join(OCR_JSON_DIR, f"{json_stem}.json"))
+        polys = np.asarray(res["rec_polys"], dtype=np.int16).reshape(-1, 4, 2)
+        np.save(os.path.join(OCR_JSON_DIR, f"{json_stem}{POLYS_SUFFIX}"), polys)
+
+
+# Device picked by `_init_engine` inside a pool worker.
+_worker_device = DEVICE
+# Engine load error caught by `_init_engine`, reported by every task instead.
+_init_error: Optional[str] = None
+
+
+def _init_engine(counter: Any, warmup_sample: str) -> None:
+    """
+    Pool initializer: claim a rank, then load and warm up this worker's engine
+    on its GPU. It must not raise, or the pool respawns the worker forever and
+    `imap` hangs; a load error is kept for `_ocr_batch` to report instead.
+    """
+    global _worker_device, _init_error
+    with counter.get_lock():
+        rank = counter.value
+        counter.value += 1
+    device = f"gpu:{rank % NUM_GPUS}" if DEVICE.startswith("gpu") else DEVICE
+    _worker_device = device
+    try:
+        _warmup(warmup_sample, device)
+    except Exception as exc:
+        _init_error = f"Không thể khởi tạo PaddleOCR trên {device}: {exc}"
+
+
+def _load_image(image_path: str) -> Tuple[str, Any]:
+    """Decode an image once so PaddleOCR does not re-read it from disk."""
+    image = cv2.imread(image_path)
+    if image is None:
+        return image_path, IOError(f"Không thể đọc ảnh: {image_path}")
+    return image_path, image
+
+
+def _predict_loaded(
+    engine: "PaddleOCR", items: List[Tuple[str, Any]]
+) -> List[Tuple[str, Any]]:
+    """
+    OCR decoded images in one `predict` call.
+
+    Args:
+        engine: PaddleOCR engine to run.
+        items: (path, image array or load error) pairs from `_load_image`.
+
+    Returns:
+        (path, result or exception) pairs in input order.
+    """
+    images = [image for _, image in items if not isinstance(image, Exception)]
+    try:
+        results = iter(_predict(engine, images) if images else ())
+    except Exception as exc:
+        return [(image_path, exc) for image_path, _ in items]
+
+    outputs: List[Tuple[str, Any]] = []
+    for image_path, image in items:
+        if isinstance(image, Exception):
+            outputs.append((image_path, image))
+            continue
+        res = next(results)
+        # Arrays carry no path; restore it so output files and the JSON's
+        # input_path keep naming by source image as before.
+        res["input_path"] = image_path
+        outputs.append((image_path, res))
+    return outputs
+
+
+def _ocr_batch(batch: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """Pool task: OCR and save one batch, returning (path, error) pairs."""
+    if _init_error is not None:
+        return [(image_path, _init_error) for image_path in batch]
+    items = [_load_image(image_path) for image_path in batch]
+    report: List[Tuple[str, Optional[str]]] = []
+    for image_path, res in _predict_loaded(get_engine(_worker_device), items):
+        if isinstance(res, Exception):
+            report.append((image_path, str(res)))
+            continue
+        try:
+            save_results([res])
+            report.append((image_path, None))
+        except Exception as exc:
+            report.append((image_path, str(exc)))
+    return report
+
+
+def _image_size(image_path: str) -> Tuple[int, int]:
+    """Read (width, height) from the image header without decoding pixels."""
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    except Exception:
+        return (0, 0)
+
+
+def _sort_by_size(image_files: List[str]) -> List[Tuple[Tuple[int, int], str]]:
+    """
+    Order images by resolution so consecutive predicts see the same input
+    shape and the detector does not reallocate workspace between them.
+    """
+    return sorted((_image_size(path), path) for path in image_files)
+
+
+def _run_folder_pool(
+    sized_files: List[Tuple[Tuple[int, int], str]], workers: int
+) -> None:
+    """Shard images into same-size batches and OCR them across `workers` processes."""
+    batches = []
+    for _, group in itertools.groupby(sized_files, key=lambda item: item[0]):
+        paths = [path for _, path in group]
+        batches.extend(
+            paths[start:start + BATCH_SIZE]
+            for start in range(0, len(paths), BATCH_SIZE)
+        )
+    counter = multiprocessing.Value("i", 0)
+    with multiprocessing.Pool(
+        processes=workers,
+        initializer=_init_engine,
+        initargs=(counter, sized_files[0][1]),
+        maxtasksperchild=MAX_TASKS_PER_WORKER,
+    ) as pool:
+        for batch, report in zip(batches, pool.imap(_ocr_batch, batches)):
+            print(f"==> Đã xử lý {len(batch)} ảnh: {', '.join(batch)}")
+            for image_path, error in report:
+                if error is not None:
+                    print(f"Lỗi khi chạy OCR cho '{image_path}': {error}")
+
+
+def run_folder(folder_path: str, workers: int = NUM_WORKERS) -> None:
     """
     Run OCR over every supported image inside the provided folder.
+
+    With `workers` > 1 batches are spread over a process pool, one PaddleOCR
+    engine per process (each costs its own GPU memory); otherwise decoding,
+    OCR and saving overlap as threads in one process.
     """
     if not os.path.isdir(folder_path):
         raise NotADirectoryError(f"Không tìm thấy thư mục đầu vào: {folder_path}")
 
-    supported_exts = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff"}
     image_files = []
-    for name in sorted(os.listdir(folder_path)):
-        path = os.path.join(folder_path, name)
-        if not os.path.isfile(path):
-            continue
-        if os.path.splitext(name)[1].lower() not in supported_exts:
-            continue
-        image_files.append(path)
+    # scandir reuses the directory entry's type info instead of a stat per file.
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(SUPPORTED_SUFFIXES):
+                continue
+            if not entry.is_file():
+                continue
+            image_files.append(entry.path)
 
     if not image_files:
         print("Không tìm thấy ảnh hợp lệ trong thư mục.")
         return
 
-    for image_path in image_files:
-        print(f"==> Đang xử lý: {image_path}")
+    sized_files = _sort_by_size(image_files)
+    image_files = [path for _, path in sized_files]
+
+    if workers > 1:
+        _run_folder_pool(sized_files, workers)
+        return
+
+    _warmup(image_files[0])
+
+    def predict(batch: List[Tuple[str, Any]]) -> List[Tuple[str, Any]]:
+        print(f"==> Đang xử lý {len(batch)} ảnh: {', '.join(path for path, _ in batch)}")
+        return _predict_loaded(get_engine(), batch)
+
+    # Decoding the next images and saving (PNG encode + JSON dump) the
+    # previous batch overlap with OCR on the current batch.
+    def image_shape(item: Tuple[str, Any]) -> Any:
+        return getattr(item[1], "shape", None)
+
+    # Batches never mix resolutions: a new image shape starts a new batch.
+    stages = [_load_image, Batched(predict, BATCH_SIZE, key=image_shape)]
+    for image_path, res in run_pipeline(image_files, stages, maxsize=BATCH_SIZE):
+        if isinstance(res, Exception):
+            print(f"Lỗi khi chạy OCR cho '{image_path}': {res}")
+            continue
         try:
-            run_ocr(image_path)
+            save_results([res])
         except Exception as exc:
             print(f"Lỗi khi chạy OCR cho '{image_path}': {exc}")
 
+
+def _warmup(sample: Any, device: str = DEVICE) -> None:
+    """Run a few untimed predicts so the first real batch is not the slow one."""
+    engine = get_engine(device)
+    for _ in range(WARMUP_RUNS):
+        try:
+            engine.predict(sample)
+        except Exception as exc:
+            print(f"Bỏ qua warmup: {exc}")
+            return
+
+
+def run_pdf(pdf_path: str, zoom: float = 2.0) -> None:
+    """
+    Render, preprocess and OCR every page of a PDF.
+
+    Rendering, preprocessing and OCR run in separate threads connected by
+    bounded queues, so the GPU keeps working while the next page is prepared.
+    """
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"Không tìm thấy tệp PDF tại: {pdf_path}")
+
+    doc_name = os.path.splitext(os.path.basename(pdf_path))[0]
+
+    with fitz.open(pdf_path) as doc:
+        total_pages = len(doc)
+
+        def render(page_index: int) -> Tuple[int, Any]:
+            return page_index, render_page(doc, page_index, zoom=zoom)
+
+        def preprocess(item: Tuple[int, Any]) -> Tuple[int, Any]:
+            page_index, image_data = item
+            # Pages are rendered grayscale; PaddleOCR needs 3-channel BGR.
+            return page_index, _to_bgr(preprocess_image_for_ocr(image_data))
+
+        def predict(items: List[Tuple[int, Any]]) -> List[Tuple[int, Any]]:
+            page_indices = [page_index for page_index, _ in items]
+            print(f"==> Đang OCR trang {', '.join(str(i + 1) for i in page_indices)}/{total_pages}")
+            images = [image for _, image in items]
+            return list(zip(page_indices, _predict(get_engine(), images)))
+
+        stages = [render, preprocess, Batched(predict, BATCH_SIZE)]
+        for page_index, res in run_pipeline(range(total_pages), stages, maxsize=BATCH_SIZE):
+            save_results([res], name=f"{doc_name}_{page_index + 1}")
+
 def print_results(entries: Iterable[Tuple[str, float]]) -> None:
     """Pretty-print OCR results."""
     for idx, (text, confidence) in enumerate(entries, start=1):
@@ -77,10 +398,17 @@ def print_results(entries: Iterable[Tuple[str, float]]) -> None:
 
 
 def main() -> None:
-    mode = input("Chọn chế độ OCR: 1) Single ảnh  2) Folder ảnh [1/2]: ").strip() or "1"
+    mode = (
+        input("Chọn chế độ OCR: 1) Single ảnh  2) Folder ảnh  3) File PDF [1/2/3]: ").strip()
+        or "1"
+    )
 
     try:
-        if mode == "2":
+        if mode == "3":
+            prompt = f"Nhập đường dẫn PDF (Enter để dùng '{DEFAULT_PDF_PATH}'): "
+            pdf_path = input(prompt).strip() or DEFAULT_PDF_PATH
+            run_pdf(pdf_path)
+        elif mode == "2":
             folder_path = input("Nhập đường dẫn folder chứa ảnh: ").strip()
             if not folder_path:
                 print("Đường dẫn folder không được bỏ trống.")
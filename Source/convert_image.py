@@ -1,9 +1,14 @@
+import cv2
 import fitz  # PyMuPDF
-from PIL import Image
 import io
 import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
-def convert_pdf_page_to_image(pdf_path, page_number, output_image_path, zoom=2.0):
+from pdf_to_preprocessed_image import pixmap_to_array
+
+def convert_pdf_page_to_image(pdf_path, page_number, output_image_path, zoom=2.0, doc=None):
     """
     Converts a specific page of a PDF file to an image file (e.g., PNG, JPG).
 
@@ -12,10 +17,14 @@ def convert_pdf_page_to_image(pdf_path, page_number, output_image_path, zoom=2.0
         page_number (int): The page number to convert (0-indexed).
         output_image_path (str): Path where the output image will be saved.
         zoom (float): Zoom factor for higher resolution (2.0 = 200% resolution).
+        doc (fitz.Document, optional): Already opened document to reuse when
+            converting several pages; it is left open for the caller.
     """
+    owns_doc = doc is None
     try:
         # Open the PDF document
-        doc = fitz.open(pdf_path)
+        if owns_doc:
+            doc = fitz.open(pdf_path)
 
         # Check if the requested page number is valid
         if 0 <= page_number < len(doc):
@@ -31,48 +40,118 @@ def convert_pdf_page_to_image(pdf_path, page_number, output_image_path, zoom=2.0
         # Render the page to a pixmap (raw image data)
         pix = page.get_pixmap(matrix=matrix, alpha=False)
 
-        # Convert the pixmap to a PIL Image object
-        # Pixmaps provide the data as bytes in memory (pix.samples)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        # View the pixmap's bytes (pix.samples) as a BGR array, no PIL copy
+        img = pixmap_to_array(pix)
 
-        # Save the PIL Image to a file
-        img.save(output_image_path)
+        # Save the image to a file
+        if not cv2.imwrite(output_image_path, img):
+            print(f"Error: Could not write image to {output_image_path}")
+            return
 
         print(f"Successfully converted page {page_number + 1} to {output_image_path}")
 
-        # Close the document
-        doc.close()
-
     except FileNotFoundError:
         print(f"Error: PDF file not found at {pdf_path}")
     except Exception as e:
         print(f"An error occurred: {e}")
+    finally:
+        # Close the document only if we opened it
+        if owns_doc and doc is not None:
+            doc.close()
+
+def _init_render_worker():
+    # Pages are already spread over processes; letting every process also
+    # fan each OpenCV call out over all cores oversubscribes the CPU.
+    cv2.setNumThreads(1)
 
-def convert_all_pdf_pages_to_images(pdf_path, output_folder="output_images", format="png", zoom=2.0):
+class IOConsumer(threading.Thread):
     """
-    Converts every page of a PDF file to separate image files.
+    Background writer: drains {'path', 'img'} messages from a queue and saves
+    them, so PNG encoding overlaps with rendering the next page.
+    Send 'quit' to stop it.
     """
-    try:
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
 
-        doc = fitz.open(pdf_path)
+    def __init__(self, write_queue):
+        super().__init__(daemon=True)
+        self.write_queue = write_queue
+        self.errors = []
+
+    def run(self):
+        while True:
+            msg = self.write_queue.get()
+            if msg == 'quit':
+                break
+            # Never let a failure kill the thread: the render loop would then
+            # block forever on the full queue.
+            try:
+                if cv2.imwrite(msg['path'], msg['img']):
+                    print(f"Saved {msg['path']}")
+                else:
+                    self.errors.append(msg['path'])
+            except Exception as e:
+                path = msg.get('path') if isinstance(msg, dict) else msg
+                self.errors.append(f"{path} ({e})")
+
+def _render_pages(pdf_path, page_numbers, output_folder, format, zoom):
+    """
+    Renders the given pages of a PDF and saves them, inside one worker process.
+    """
+    doc = fitz.open(pdf_path)
+    write_queue = queue.Queue(maxsize=8)
+    writer = IOConsumer(write_queue)
+    writer.start()
+    try:
         matrix = fitz.Matrix(zoom, zoom)
 
-        for page_num in range(len(doc)):
+        for page_num in page_numbers:
             page = doc.load_page(page_num)
             pix = page.get_pixmap(matrix=matrix, alpha=False)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            img = pixmap_to_array(pix)
 
             # Create the output filename (e.g., page_001.png)
             output_filename = os.path.join(
                 output_folder,
                 f"page_{page_num + 1:03d}.{format}"
             )
-            img.save(output_filename)
-            print(f"Saved {output_filename}")
-
+            write_queue.put({'path': output_filename, 'img': img})
+    finally:
         doc.close()
+        write_queue.put('quit')
+        writer.join()
+
+    if writer.errors:
+        raise IOError(f"Could not write: {', '.join(writer.errors)}")
+
+def convert_all_pdf_pages_to_images(pdf_path, output_folder="output_images", format="png", zoom=2.0, max_workers=4):
+    """
+    Converts every page of a PDF file to separate image files.
+
+    Pages are rendered by up to `max_workers` processes, each opening the PDF
+    once. Processes rather than threads because PyMuPDF is not thread-safe.
+    """
+    try:
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        with fitz.open(pdf_path) as doc:
+            total_pages = len(doc)
+
+        workers = max(1, min(max_workers, total_pages))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker) as executor:
+            futures = [
+                executor.submit(
+                    _render_pages,
+                    pdf_path,
+                    range(worker, total_pages, workers),
+                    output_folder,
+                    format,
+                    zoom,
+                )
+                for worker in range(workers)
+            ]
+            for future in futures:
+                future.result()
+
         print(f"\nAll pages converted and saved in the '{output_folder}' folder.")
 
     except FileNotFoundError:
@@ -2,6 +2,12 @@ import cv2
 import numpy as np
 from PIL import Image
 
+# Ảnh đầu ra chỉ là bước trung gian cho OCR: nén PNG nhẹ để giảm thời gian ghi.
+PNG_WRITE_PARAMS = [
+    cv2.IMWRITE_PNG_COMPRESSION, 1,
+    cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+]
+
 def preprocess_for_ocr(image_path, output_path="preprocessed_image.png"):
     """
     Thực hiện tiền xử lý cơ bản cho ảnh chữ Hán (Chuyển xám, Khử nhiễu, Ngưỡng).
@@ -28,7 +34,7 @@ def preprocess_for_ocr(image_path, output_path="preprocessed_image.png"):
         #print("Đã áp dụng Thresholding Otsu.")
 
         # Lưu ảnh đã tiền xử lý
-        cv2.imwrite(output_path, binary)
+        cv2.imwrite(output_path, binary, PNG_WRITE_PARAMS)
         #print(f"Ảnh đã xử lý được lưu tại: {output_path}")
         
         return output_path
@@ -1,70 +1,158 @@
+import functools
 import os
-from typing import Optional
+import shutil
+from typing import List, Optional, Tuple
 
 import cv2
 import fitz  # PyMuPDF
 import numpy as np
-from PIL import Image
+
+from pipeline import run_pipeline
 
 
 # Easily configurable default PDF path.
 INPUT_PDF_PATH = os.path.join("data", "giam_cuong.pdf")
 
+# Sauvola binarization needs cv2.ximgproc from opencv-contrib-python; without
+# it preprocessing falls back to Gaussian blur + adaptive threshold + dilate.
+HAS_XIMGPROC = hasattr(cv2, "ximgproc")
+SAUVOLA_BLOCK_SIZE = 41
+SAUVOLA_K = 0.2
+
+# PP-OCRv5 is trained on natural images and reads plain grayscale better than
+# thresholded/dilated pages; enable only for Tesseract-style engines.
+STRONG_PREPROCESSING = False
+
+# Saved pages are only intermediates for OCR: trade a little file size for
+# much cheaper zlib work (default level is 3).
+PNG_WRITE_PARAMS = [
+    cv2.IMWRITE_PNG_COMPRESSION, 1,
+    cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+]
+
 
-def convert_pdf_to_image(pdf_path: str, page_num: int, zoom: float = 2.0) -> np.ndarray:
+def pixmap_to_array(pix: fitz.Pixmap) -> np.ndarray:
     """
-    Convert a specific PDF page to an OpenCV-friendly image array.
+    Wrap a pixmap's sample buffer as an OpenCV array.
+
+    Grayscale pixmaps become a (H, W) array. For RGB pixmaps the RGB -> BGR
+    reorder is a strided view over `pix.samples_mv`; the only copy made is
+    the final one into a contiguous array.
+    """
+    if pix.n == 1:
+        gray_array = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+        return gray_array.reshape(pix.height, pix.width).copy()
+
+    rgb_array = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(
+        pix.height, pix.width, pix.n
+    )
+    return np.ascontiguousarray(rgb_array[:, :, ::-1])
+
+
+def render_page(
+    doc: fitz.Document, page_num: int, zoom: float = 2.0, grayscale: bool = True
+) -> np.ndarray:
+    """
+    Render a page of an already opened PDF to an OpenCV-friendly image array.
 
     Args:
-        pdf_path: Path to the PDF file.
+        doc: Open PyMuPDF document; keep it open across pages so the xref
+            table is parsed only once.
         page_num: Zero-based page index to convert.
         zoom: Magnification factor for higher resolution renders.
+        grayscale: Render straight to a single gray channel (a third of the
+            bytes of an RGB render) instead of BGR.
 
     Returns:
-        np.ndarray: Image in BGR color space suitable for OpenCV pipelines.
+        np.ndarray: (H, W) grayscale image, or (H, W, 3) BGR image when
+        `grayscale` is False.
+    """
+    if zoom <= 0:
+        raise ValueError("Giá trị zoom phải lớn hơn 0.")
+
+    if not (0 <= page_num < len(doc)):
+        raise ValueError(
+            f"Số trang không hợp lệ. PDF có {len(doc)} trang, "
+            f"nhưng bạn yêu cầu trang {page_num + 1}."
+        )
+
+    page = doc.load_page(page_num)
+    matrix = fitz.Matrix(zoom, zoom)
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    pix = page.get_pixmap(matrix=matrix, colorspace=colorspace, alpha=False)
+    return pixmap_to_array(pix)
+
+
+def convert_pdf_to_image(
+    pdf_path: str, page_num: int, zoom: float = 2.0, grayscale: bool = True
+) -> np.ndarray:
+    """
+    Open a PDF and render a single page; see `render_page`.
+
+    Use `render_page` with one open document when converting several pages.
     """
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"Không tìm thấy tệp PDF tại: {pdf_path}")
 
-    if zoom <= 0:
-        raise ValueError("Giá trị zoom phải lớn hơn 0.")
+    with fitz.open(pdf_path) as doc:
+        return render_page(doc, page_num, zoom=zoom, grayscale=grayscale)
 
-    doc = fitz.open(pdf_path)
-    try:
-        if not (0 <= page_num < len(doc)):
-            raise ValueError(
-                f"Số trang không hợp lệ. PDF có {len(doc)} trang, "
-                f"nhưng bạn yêu cầu trang {page_num + 1}."
-            )
-
-        page = doc.load_page(page_num)
-        matrix = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=matrix, alpha=False)
-
-        # Convert PyMuPDF pixmap to PIL image, then to numpy for OpenCV.
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        rgb_array = np.array(img)
-        bgr_array = cv2.cvtColor(rgb_array, cv2.COLOR_RGB2BGR)
-        return bgr_array
-    finally:
-        doc.close()
-
-
-def preprocess_image_for_ocr(image_data: np.ndarray) -> np.ndarray:
+
+@functools.lru_cache(maxsize=1)
+def _opencl_enabled() -> bool:
     """
-    Apply grayscale, Gaussian blur, and adaptive thresholding to enhance OCR.
+    Enable OpenCV's T-API the first time the UMat chain runs.
+
+    Probing OpenCL at import would start the GPU driver in every process that
+    imports this module, including ones that fork worker pools afterwards.
+    """
+    if not cv2.ocl.haveOpenCL():
+        return False
+    cv2.ocl.setUseOpenCL(True)
+    return True
+
+
+def preprocess_image_for_ocr(image_data: np.ndarray, strong: bool = False) -> np.ndarray:
+    """
+    Convert to grayscale and, with `strong`, binarize to enhance OCR.
+
+    Strong preprocessing uses a single-pass Sauvola threshold (integral-image
+    mean/variance) when opencv-contrib is installed, otherwise Gaussian blur,
+    adaptive thresholding and a light dilation.
 
     Args:
-        image_data: Input image array in BGR color space.
+        image_data: Input image array, BGR or already single-channel grayscale.
+        strong: Binarize the page (for Tesseract-style engines). PaddleOCR
+            does better on the untouched grayscale image.
 
     Returns:
-        np.ndarray: Binarized image ready for OCR.
+        np.ndarray: Grayscale image, or binarized image when `strong` is True.
     """
     if image_data is None:
         raise ValueError("Dữ liệu ảnh đầu vào không hợp lệ.")
 
-    gray = cv2.cvtColor(image_data, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (9, 9), 0)
+    if image_data.ndim == 2:
+        gray = image_data
+    else:
+        gray = cv2.cvtColor(image_data, cv2.COLOR_BGR2GRAY)
+
+    if not strong:
+        return gray
+
+    if HAS_XIMGPROC:
+        # Sauvola strokes come out thick enough that no dilation is needed.
+        return cv2.ximgproc.niBlackThreshold(
+            gray,
+            255,
+            cv2.THRESH_BINARY,
+            SAUVOLA_BLOCK_SIZE,
+            SAUVOLA_K,
+            binarizationMethod=cv2.ximgproc.BINARIZATION_SAUVOLA,
+        )
+
+    # Keep the whole chain on the device; download only the final result.
+    src = cv2.UMat(gray) if _opencl_enabled() else gray
+    blurred = cv2.GaussianBlur(src, (9, 9), 0)
     binary = cv2.adaptiveThreshold(
         blurred,
         255,
@@ -75,30 +163,59 @@ def preprocess_image_for_ocr(image_data: np.ndarray) -> np.ndarray:
     )
     kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
     strengthened = cv2.dilate(binary, kernel, iterations=1)
+    if isinstance(strengthened, cv2.UMat):
+        return strengthened.get()
     return strengthened
 
 
-def _prompt_page_number(total_pages: int) -> Optional[int]:
-    """Ask the user for a 1-based page number and convert to zero-based index."""
+def _prompt_page_numbers(total_pages: int) -> Optional[List[int]]:
+    """
+    Ask the user for a 1-based page number (or 'all') and convert to
+    zero-based indices.
+    """
     try:
         user_input = input(
-            f"Nhập số trang muốn chuyển đổi (1-{total_pages}): "
+            f"Nhập số trang muốn chuyển đổi (1-{total_pages}, 'all' cho tất cả): "
         ).strip()
         if not user_input:
             print("Bạn chưa nhập số trang.")
             return None
+        if user_input.lower() == "all":
+            return list(range(total_pages))
 
         page_number = int(user_input)
         page_index = page_number - 1
         if not (0 <= page_index < total_pages):
             print("Số trang nằm ngoài phạm vi cho phép.")
             return None
-        return page_index
+        return [page_index]
     except ValueError:
         print("Giá trị trang không hợp lệ. Vui lòng nhập số nguyên.")
         return None
 
 
+def _save_page(
+    raw_output_path: str,
+    processed_output_path: str,
+    image_data: np.ndarray,
+    processed_image: np.ndarray,
+) -> None:
+    """Write the raw render and the preprocessed image for one page."""
+    # Save raw export before preprocessing.
+    if not cv2.imwrite(raw_output_path, image_data, PNG_WRITE_PARAMS):
+        raise IOError("Không thể lưu ảnh gốc trước khi xử lý.")
+
+    # Without strong preprocessing the page is unchanged: copy the encoded
+    # file instead of compressing the same pixels a second time.
+    if processed_image is image_data:
+        shutil.copyfile(raw_output_path, processed_output_path)
+        return
+
+    # Save processed image to the Processed directory.
+    if not cv2.imwrite(processed_output_path, processed_image, PNG_WRITE_PARAMS):
+        raise IOError("Không thể lưu ảnh đầu ra.")
+
+
 def main() -> None:
     """CLI entry point for the PDF -> preprocessed image workflow."""
     pdf_path = INPUT_PDF_PATH
@@ -107,55 +224,55 @@ def main() -> None:
         return
 
     try:
-        with fitz.open(pdf_path) as doc:
-            total_pages = len(doc)
+        doc = fitz.open(pdf_path)
     except Exception as exc:
         print(f"Lỗi khi mở PDF: {exc}")
         return
 
-    page_index = _prompt_page_number(total_pages)
-    if page_index is None:
-        return
-
-    doc_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    page_label = page_index + 1
-
-    content_dir = "content"
-    processed_dir = "Processed"
-    os.makedirs(content_dir, exist_ok=True)
-    os.makedirs(processed_dir, exist_ok=True)
-
-    raw_filename = f"{doc_name}_{page_label}.png"
-    raw_output_path = os.path.join(content_dir, raw_filename)
-    processed_output_path = os.path.join(processed_dir, raw_filename)
-
-    try:
-        image_data = convert_pdf_to_image(pdf_path, page_index, zoom=2.0)
-        processed_image = preprocess_image_for_ocr(image_data)
-
-        # Save raw export before preprocessing.
-        if not cv2.imwrite(raw_output_path, image_data):
-            raise IOError("Không thể lưu ảnh gốc trước khi xử lý.")
-
-        # Save processed image to the Processed directory.
-        if not cv2.imwrite(processed_output_path, processed_image):
-            raise IOError("Không thể lưu ảnh đầu ra.")
-
-        print(
-            "Đã xử lý xong:\n"
-            f"- Ảnh gốc: {os.path.abspath(raw_output_path)}\n"
-            f"- Ảnh tiền xử lý: {os.path.abspath(processed_output_path)}"
-        )
-    except FileNotFoundError as fnf_err:
-        print(f"Lỗi: {fnf_err}")
-    except ValueError as val_err:
-        print(f"Lỗi: {val_err}")
-    except IOError as io_err:
-        print(f"Lỗi khi lưu ảnh: {io_err}")
-    except Exception as exc:
-        print(f"Đã xảy ra lỗi không xác định: {exc}")
+    with doc:
+        page_indices = _prompt_page_numbers(len(doc))
+        if page_indices is None:
+            return
+
+        doc_name = os.path.splitext(os.path.basename(pdf_path))[0]
+
+        content_dir = "content"
+        processed_dir = "Processed"
+        os.makedirs(content_dir, exist_ok=True)
+        os.makedirs(processed_dir, exist_ok=True)
+
+        def render(page_index: int) -> Tuple[int, np.ndarray]:
+            return page_index, render_page(doc, page_index, zoom=2.0)
+
+        def preprocess(item: Tuple[int, np.ndarray]) -> Tuple[int, np.ndarray, np.ndarray]:
+            page_index, image_data = item
+            processed = preprocess_image_for_ocr(image_data, strong=STRONG_PREPROCESSING)
+            return page_index, image_data, processed
+
+        try:
+            # Render, preprocess and save run in separate threads so one page is
+            # encoded to disk while the next is being rendered.
+            pages = run_pipeline(page_indices, [render, preprocess])
+            for page_index, image_data, processed_image in pages:
+                raw_filename = f"{doc_name}_{page_index + 1}.png"
+                raw_output_path = os.path.join(content_dir, raw_filename)
+                processed_output_path = os.path.join(processed_dir, raw_filename)
+                _save_page(raw_output_path, processed_output_path, image_data, processed_image)
+
+                print(
+                    "Đã xử lý xong:\n"
+                    f"- Ảnh gốc: {os.path.abspath(raw_output_path)}\n"
+                    f"- Ảnh tiền xử lý: {os.path.abspath(processed_output_path)}"
+                )
+        except FileNotFoundError as fnf_err:
+            print(f"Lỗi: {fnf_err}")
+        except ValueError as val_err:
+            print(f"Lỗi: {val_err}")
+        except IOError as io_err:
+            print(f"Lỗi khi lưu ảnh: {io_err}")
+        except Exception as exc:
+            print(f"Đã xảy ra lỗi không xác định: {exc}")
 
 
 if __name__ == "__main__":
     main()
-
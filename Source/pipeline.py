@@ -0,0 +1,194 @@
+"""
+Small thread pipeline used to overlap CPU-bound steps (PDF rendering,
+OpenCV preprocessing, file I/O) with GPU-bound OCR inference.
+
+Each stage runs in its own thread and hands items to the next one through a
+bounded queue, so a slow stage applies back-pressure instead of letting the
+previous one buffer whole documents in memory.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Union
+
+_SENTINEL = object()
+_POLL_SECONDS = 0.1
+
+
+class _Failure:
+    """Carries an exception raised inside a stage down to the consumer."""
+
+    def __init__(self, exc: BaseException) -> None:
+        self.exc = exc
+
+
+class Batched:
+    """
+    Stage marker: call `fn` on lists of up to `size` items instead of one item
+    at a time. A partial batch is flushed once `max_wait` seconds have passed
+    since its first item arrived, or, when `key` is given, as soon as an item
+    with a different key arrives. `fn` must return one output per input.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], Sequence[Any]],
+        size: int,
+        max_wait: float = 0.05,
+        key: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        if size < 1:
+            raise ValueError("Batch size must be at least 1.")
+        self.fn = fn
+        self.size = size
+        self.max_wait = max_wait
+        self.key = key
+
+
+def _put(out_q: "queue.Queue[Any]", item: Any, stop: threading.Event) -> bool:
+    """Put with periodic stop checks so producers never block forever."""
+    while not stop.is_set():
+        try:
+            out_q.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _feed(source: Iterable[Any], out_q: "queue.Queue[Any]", stop: threading.Event) -> None:
+    try:
+        for item in source:
+            if not _put(out_q, item, stop):
+                return
+    except BaseException as exc:
+        _put(out_q, _Failure(exc), stop)
+    finally:
+        _put(out_q, _SENTINEL, stop)
+
+
+def _work(
+    stage: Callable[[Any], Any],
+    in_q: "queue.Queue[Any]",
+    out_q: "queue.Queue[Any]",
+    stop: threading.Event,
+) -> None:
+    try:
+        while not stop.is_set():
+            try:
+                item = in_q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if item is _SENTINEL:
+                return
+            if not isinstance(item, _Failure):
+                try:
+                    item = stage(item)
+                except BaseException as exc:
+                    item = _Failure(exc)
+            if not _put(out_q, item, stop):
+                return
+    finally:
+        _put(out_q, _SENTINEL, stop)
+
+
+def _work_batched(
+    stage: Batched,
+    in_q: "queue.Queue[Any]",
+    out_q: "queue.Queue[Any]",
+    stop: threading.Event,
+) -> None:
+    def flush(batch: List[Any]) -> bool:
+        try:
+            outputs = list(stage.fn(batch))
+            if len(outputs) != len(batch):
+                raise RuntimeError(
+                    f"Batch stage returned {len(outputs)} outputs for {len(batch)} inputs."
+                )
+        except BaseException as exc:
+            outputs = [_Failure(exc)] * len(batch)
+        return all(_put(out_q, output, stop) for output in outputs)
+
+    batch: List[Any] = []
+    deadline = 0.0
+    try:
+        while not stop.is_set():
+            timeout = _POLL_SECONDS
+            if batch:
+                timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+            try:
+                item = in_q.get(timeout=timeout)
+            except queue.Empty:
+                if batch and time.monotonic() >= deadline:
+                    if not flush(batch):
+                        return
+                    batch = []
+                continue
+            if item is _SENTINEL:
+                if batch:
+                    flush(batch)
+                return
+            if isinstance(item, _Failure):
+                # Flush first so the failure keeps its place in input order.
+                if batch:
+                    if not flush(batch):
+                        return
+                    batch = []
+                if not _put(out_q, item, stop):
+                    return
+                continue
+            if batch and stage.key is not None and stage.key(item) != stage.key(batch[0]):
+                if not flush(batch):
+                    return
+                batch = []
+            if not batch:
+                deadline = time.monotonic() + stage.max_wait
+            batch.append(item)
+            if len(batch) >= stage.size:
+                if not flush(batch):
+                    return
+                batch = []
+    finally:
+        _put(out_q, _SENTINEL, stop)
+
+
+def run_pipeline(
+    source: Iterable[Any],
+    stages: Sequence[Union[Callable[[Any], Any], Batched]],
+    maxsize: int = 4,
+) -> Iterator[Any]:
+    """
+    Stream items from `source` through `stages`, one thread per stage.
+
+    Args:
+        source: Iterable producing the input items (consumed in its own thread).
+        stages: Callables applied in order; each receives the previous output.
+            Wrap a stage in `Batched` to feed it lists of items instead.
+        maxsize: Capacity of every inter-stage queue.
+
+    Yields:
+        The output of the last stage for each input item, in input order.
+
+    Raises:
+        Any exception raised by `source` or a stage, re-raised in the caller.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=maxsize) for _ in range(len(stages) + 1)]
+
+    with ThreadPoolExecutor(max_workers=len(stages) + 1) as executor:
+        executor.submit(_feed, source, queues[0], stop)
+        for idx, stage in enumerate(stages):
+            worker = _work_batched if isinstance(stage, Batched) else _work
+            executor.submit(worker, stage, queues[idx], queues[idx + 1], stop)
+
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _SENTINEL:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            stop.set()